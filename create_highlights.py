@@ -1,31 +1,81 @@
+import argparse
+import asyncio
+import functools
 import json
+import multiprocessing
 import os
-import sys
-import glob
 import subprocess
 import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import yt_dlp
 
+try:
+    import orjson # Optional: several times faster than json on large exports
+except ImportError:
+    orjson = None
+
+# Default YouTube download resolution (override with --height)
+DEFAULT_HEIGHT = 720
+# Concurrent YouTube fetches, each in a worker process of its own; higher
+# values tend to trigger throttling
+MAX_PARALLEL_DOWNLOADS = 4
+# libx264 is multithreaded itself: run half as many local ffmpeg runs as
+# cores, each cutting one segment with its decoder and encoder capped at a
+# couple of threads, so together they roughly fill the machine
+ENCODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+FFMPEG_THREADS = 2
+# Seconds before an IN point to search for the keyframe a copied cut starts on
+KEYFRAME_SEARCH_WINDOW = 30
+# Resolved YouTube video info is kept here between runs; the stream URLs it
+# contains expire after a few hours, so entries are only trusted for an hour
+INFO_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "yt_highlights")
+INFO_CACHE_TTL = 3600
+# ffprobe results for local sources, reused while the file is unchanged
+PROBE_CACHE_FILE = os.path.join(INFO_CACHE_DIR, "probe.json")
+# Rough size of 1080p footage (~12 Mbps), scaled by pixel count to the
+# chosen --height, used to estimate the disk space a job needs, plus some
+# headroom on top (skip the check with --skip-disk-check)
+ESTIMATED_BYTES_PER_SECOND = 1.5e6
+DISK_SPACE_MARGIN = 1.2
+# H.264 encoders in order of preference, each with a constant-quality
+# setting roughly equivalent to libx264's default CRF 23. The hardware
+# encoders are used when available; libx264 is the fallback.
+H264_ENCODERS = [
+    ("h264_nvenc", ["-preset", "p4", "-rc", "vbr", "-cq", "23"]),
+    ("h264_qsv", ["-preset", "faster", "-global_quality", "23"]),
+    ("h264_videotoolbox", ["-q:v", "65"]),
+    ("libx264", ["-preset", "fast", "-crf", "23"]),
+]
+
+Segment = namedtuple('Segment', 'mode video_id video_filename video_title start end')
+
 def main():
-    # 0. Check for command line argument for folder path
-    if len(sys.argv) > 1:
-        target_dir = sys.argv[1]
-    else:
-        target_dir = "." # Default to current directory
+    # 0. Check command line arguments (folder path and download resolution)
+    parser = argparse.ArgumentParser(description="Create a highlight video from the JSON files exported by video-editor.html.")
+    parser.add_argument("folder", nargs="?", default=".", help="folder containing the JSON files (default: current directory)")
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT,
+                        help=f"YouTube download resolution (default: {DEFAULT_HEIGHT}, e.g. 1080)")
+    parser.add_argument("--skip-disk-check", action="store_true",
+                        help="start even if the free disk space looks too small")
+    args = parser.parse_args()
+    target_dir = args.folder
 
     if not os.path.isdir(target_dir):
         print(f"❌ Error: The directory '{target_dir}' does not exist.")
         return
 
-    # Define paths
-    temp_dir = os.path.join(target_dir, "temp_clips")
-    list_file_path = os.path.join(target_dir, "ffmpeg_list.txt")
+    # Define paths (temp_dir is absolute, so every clip path built from it is too)
+    temp_dir = os.path.abspath(os.path.join(target_dir, "temp_clips"))
     output_video = os.path.join(target_dir, "Final_Highlights.mp4")
 
     try:
-        # 1. Find all JSON files
-        search_pattern = os.path.join(target_dir, "*.json")
-        json_files = sorted(glob.glob(search_pattern))
+        # 1. Find all JSON files (in alphabetical order), skipping hidden ones
+        #    such as the ._*.json files macOS leaves on non-Mac drives
+        with os.scandir(target_dir) as entries:
+            json_files = sorted(e.path for e in entries
+                                if e.name.lower().endswith('.json') and not e.name.startswith('.') and e.is_file())
         
         if not json_files:
             print(f"❌ No JSON files found in directory: {target_dir}")
@@ -38,24 +88,18 @@ def main():
         # 2. Parse all JSON files
         for j_file in json_files:
             try:
-                with open(j_file, 'r') as f:
-                    data = json.load(f)
-                    
-                    # Detect mode (default to youtube if missing)
-                    mode = data.get('mode', 'youtube')
-                    video_id = data.get('videoId')
-                    video_filename = data.get('videoPath')
-                    video_title = data.get('videoTitle', 'unknown')
-                    
-                    for seg in data.get('segments', []):
-                        all_segments.append({
-                            'mode': mode,
-                            'video_id': video_id,
-                            'video_filename': video_filename,
-                            'video_title': video_title,
-                            'start': seg['start'],
-                            'end': seg['end']
-                        })
+                data = load_json(j_file)
+
+                # Detect mode (default to youtube if missing)
+                mode = data.get('mode', 'youtube')
+                video_id = data.get('videoId')
+                video_filename = data.get('videoPath')
+                video_title = data.get('videoTitle', 'unknown')
+
+                all_segments.extend(
+                    Segment(mode, video_id, video_filename, video_title, seg['start'], seg['end'])
+                    for seg in data.get('segments', ())
+                )
             except Exception as e:
                 print(f"   ⚠️ Skipping invalid file {os.path.basename(j_file)}: {e}")
 
@@ -65,95 +109,34 @@ def main():
 
         print(f"🎬 Found {len(all_segments)} total segments to process.")
 
+        # Make sure the clips and the final video will fit before starting
+        # (both exist on disk at the same time, hence the factor of 2)
+        total_seconds = sum(seg.end - seg.start for seg in all_segments)
+        bytes_per_second = ESTIMATED_BYTES_PER_SECOND * (args.height / 1080) ** 2
+        needed = total_seconds * bytes_per_second * 2 * DISK_SPACE_MARGIN
+        free = shutil.disk_usage(target_dir).free
+        if needed > free and not args.skip_disk_check:
+            print(f"❌ Not enough disk space: need about {needed/1e9:.1f} GB, have {free/1e9:.1f} GB free.")
+            print("   (Pass --skip-disk-check to start anyway)")
+            return
+
         # 3. Create temp directory
         os.makedirs(temp_dir, exist_ok=True)
-        downloaded_clips = []
 
         print("\n⬇️  Processing Segments...")
 
-        # 4. Processing Loop
-        for i, seg in enumerate(all_segments):
-            
-            output_filename = os.path.join(temp_dir, f"clip_{i:03d}.mp4")
-            
-            # --- PATH A: YOUTUBE ---
-            if seg['mode'] == 'youtube':
-                print(f"   [{i+1}/{len(all_segments)}] Downloading (YT): {seg['video_title']}")
-                
-                url = f"https://www.youtube.com/watch?v={seg['video_id']}"
-                
-                ydl_opts = {
-                    'format': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                    'quiet': True,
-                    'no_warnings': True,
-                    'download_ranges': lambda info, ydl: [{'start_time': seg['start'], 'end_time': seg['end']}], 
-                    'force_keyframes_at_cuts': True,
-                    'outtmpl': output_filename,
-                }
-                
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([url])
-                    
-                    # yt-dlp might tweak the extension or name, find the match
-                    matches = glob.glob(os.path.join(temp_dir, f"clip_{i:03d}*"))
-                    if matches:
-                        downloaded_clips.append(matches[0])
-                    else:
-                        print(f"   ⚠️ Error: Download failed for segment {i}")
-                except Exception as e:
-                    print(f"   ❌ YouTube Error: {e}")
-
-            # --- PATH B: LOCAL FILE ---
-            elif seg['mode'] == 'local':
-                source_file = os.path.join(target_dir, seg['video_filename'])
-                print(f"   [{i+1}/{len(all_segments)}] Extracting (Local): {seg['video_filename']} ({format_time(seg['start'])} - {format_time(seg['end'])})")
-                
-                if not os.path.exists(source_file):
-                    print(f"      ❌ ERROR: Source file not found: {source_file}")
-                    print("      (Make sure the video file is in the same folder as this script)")
-                    continue
-
-                # Use FFmpeg to slice local file
-                # -ss = start, -to = end (faster and accurate if before -i)
-                cmd = [
-                    "ffmpeg", "-y",
-                    "-ss", str(seg['start']),
-                    "-to", str(seg['end']),
-                    "-i", source_file,
-                    "-c:v", "libx264", "-c:a", "aac", # Re-encode to ensure uniform format for concatenation
-                    "-preset", "fast",
-                    "-avoid_negative_ts", "make_zero",
-                    output_filename
-                ]
-
-                try:
-                    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    downloaded_clips.append(output_filename)
-                except subprocess.CalledProcessError as e:
-                    print(f"      ❌ FFmpeg Error: {e}")
+        # 4. Processing Loop (downloads and local cuts run concurrently, and
+        #    the merge starts once they have all finished)
+        downloaded_clips, merge_error = asyncio.run(
+            main_async(all_segments, target_dir, temp_dir, output_video, args.height))
 
         # 5. Concatenate Clips
-        if len(downloaded_clips) > 0:
-            print("\nEditing final video...")
-            
-            with open(list_file_path, 'w') as f:
-                for clip in downloaded_clips:
-                    abs_path = os.path.abspath(clip).replace("'", "'\\''")
-                    f.write(f"file '{abs_path}'\n")
-
-            cmd = [
-                "ffmpeg", "-f", "concat", "-safe", "0", "-i", list_file_path,
-                "-c", "copy", "-y", output_video
-            ]
-            
-            try:
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                print(f"\n✅ Success! Video saved as: {output_video}")
-            except Exception as e:
-                print(f"\n❌ Merge Error: {e}")
-        else:
+        if not downloaded_clips:
             print("❌ No clips were successfully generated.")
+        elif merge_error:
+            print(f"\n❌ Merge Error: {merge_error}")
+        else:
+            print(f"\n✅ Success! Video saved as: {output_video}")
 
     except Exception as main_e:
         print(f"\n❌ A Critical Error Occurred: {main_e}")
@@ -161,14 +144,411 @@ def main():
     finally:
         # Cleanup
         print("\n🧹 Cleaning up temporary files...")
-        if os.path.exists(list_file_path):
-            try: os.remove(list_file_path)
-            except: pass
         if os.path.exists(temp_dir):
-            try: shutil.rmtree(temp_dir)
-            except: pass
+            _fast_rmtree(temp_dir)
         print("✨ Done.")
 
+async def main_async(all_segments, target_dir, temp_dir, output_video, height):
+    # Every segment index is reported here exactly once, with its clip path
+    # or None if it failed
+    ready = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    # Local extraction is CPU-bound: cap the number of ffmpeg runs at once
+    encode_slots = asyncio.Semaphore(ENCODE_WORKERS)
+    download_slots = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+    # Workers are spawned rather than forked, so they never inherit the
+    # pipes of the ffmpeg processes this loop runs
+    spawn = multiprocessing.get_context("spawn")
+
+    async def fetch(video_id, items):
+        async with download_slots:
+            # Each video gets a worker process of its own. A worker that dies
+            # only breaks its own pool, so only this video's segments are lost.
+            pool = ProcessPoolExecutor(max_workers=1, mp_context=spawn)
+            try:
+                paths = await loop.run_in_executor(pool, _blocking_download, video_id, items, temp_dir, len(all_segments), height)
+            except Exception as e:
+                print(f"   ❌ YouTube Error: {e}")
+                paths = [None] * len(items)
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        for (i, _), path in zip(items, paths):
+            ready.put_nowait((i, path))
+
+    async def extract(video_filename, items):
+        paths = await _extract_local(video_filename, items, target_dir, temp_dir, len(all_segments), video_encoder, encode_slots)
+        for (i, _), path in zip(items, paths):
+            ready.put_nowait((i, path))
+
+    # One yt-dlp session per video, no matter how many segments come from it
+    youtube_groups = {}
+    local_groups = {}
+    for i, seg in enumerate(all_segments):
+        if seg.mode == 'youtube':
+            youtube_groups.setdefault(seg.video_id, []).append((i, seg))
+        elif seg.mode == 'local':
+            local_groups.setdefault(seg.video_filename, []).append((i, seg))
+        else:
+            ready.put_nowait((i, None))
+
+    # Re-encoding is only needed to make the clips uniform. If there are no
+    # YouTube clips and every local source has the same stream parameters,
+    # the segments can be stream-copied instead.
+    signatures = set()
+    if local_groups and not youtube_groups:
+        probe_cache = _load_probe_cache()
+        signatures = {_probe_signature(os.path.join(target_dir, name), probe_cache) for name in local_groups}
+        _save_probe_cache(probe_cache)
+    stream_copy = not youtube_groups and len(signatures) == 1 and None not in signatures
+    video_encoder = None if stream_copy or not local_groups else detect_video_encoder()
+
+    merge_result, *_ = await asyncio.gather(
+        merge_clips(ready, len(all_segments), output_video),
+        *(fetch(video_id, items) for video_id, items in youtube_groups.items()),
+        *(extract(video_filename, items) for video_filename, items in local_groups.items()),
+    )
+    return merge_result
+
+async def merge_clips(ready, total, output_video):
+    # The concat demuxer reads the whole list before it muxes anything, so
+    # ffmpeg is only started once every clip has been reported. The list then
+    # goes to its stdin; no list file ever touches the disk.
+    # Clips are reported in the order they finish: slot them back into
+    # segment order
+    clips = [None] * total
+    for _ in range(total):
+        i, clip = await ready.get()
+        clips[i] = clip
+    merged = [clip for clip in clips if clip]
+
+    if not merged:
+        return merged, None
+
+    payload = "".join("file '{}'\n".format(clip.replace("'", "'\\''")) for clip in merged).encode()
+
+    print("\nEditing final video...")
+    # Shift the output timestamps so the merged video starts at zero
+    error = await _concat(payload, ["-c", "copy", "-avoid_negative_ts", "make_zero"], output_video)
+    if error is None:
+        # The concat demuxer can drop a stream without failing (e.g. the
+        # audio, when the clips disagree on it), so check the result
+        expected = await asyncio.to_thread(_stream_count, merged[0])
+        actual = await asyncio.to_thread(_stream_count, output_video)
+        if expected is not None and actual is not None and actual < expected:
+            error = f"merged video has {actual} of {expected} streams"
+    if error is None:
+        return merged, None
+
+    # Stream copy fails when the clips differ in resolution or codec
+    # (e.g. 720p and 1080p sources): re-encode the whole concat instead
+    print(f"   ⚠️ Direct merge failed ({error}), re-encoding (this takes longer)...")
+    error = await _concat(payload, [*detect_video_encoder(), "-c:a", "aac"], output_video)
+    return merged, error
+
+async def _concat(payload, codec_args, output_video):
+    cmd = [
+        "ffmpeg", "-hide_banner", "-nostats", "-f", "concat", "-safe", "0",
+        "-protocol_whitelist", "file,pipe", "-i", "pipe:0",
+        *codec_args, "-y", output_video
+    ]
+    proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        try:
+            proc.stdin.write(payload)
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # ffmpeg is already gone; its exit code says why
+        proc.stdin.close()
+        return await _wait_ffmpeg(proc)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+        raise
+
+async def _wait_ffmpeg(proc):
+    # Returns None on success, otherwise a description of what went wrong,
+    # ending with ffmpeg's last stderr line (usually the actual error)
+    try:
+        last_line = ""
+        async for raw_line in proc.stderr:
+            line = raw_line.decode(errors='replace').strip()
+            if line:
+                last_line = line
+        if await proc.wait() != 0:
+            return f"ffmpeg exited with code {proc.returncode}" + (f": {last_line}" if last_line else "")
+        return None
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            try: proc.kill()
+            except ProcessLookupError: pass
+        raise
+
+# --- PATH A: YOUTUBE ---
+def _blocking_download(video_id, items, temp_dir, total, height):
+    for i, seg in items:
+        print(f"   [{i+1}/{total}] Downloading (YT): {seg.video_title} ({format_time(seg.start)} - {format_time(seg.end)})")
+
+    url = f"https://www.youtube.com/watch?v={video_id}"
+
+    # 'index' ends up as %(section_number)s, so each range is written to the
+    # same clip_NNN name it would get when downloaded on its own
+    ranges = [{'start_time': seg.start, 'end_time': seg.end, 'index': i} for i, seg in items]
+
+    ydl_opts = {
+        # Ask for exactly the requested height first, so clips from different
+        # videos share one resolution and concat without a re-encode
+        'format': (f'bestvideo[height={height}][ext=mp4]+bestaudio[ext=m4a]'
+                   f'/bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]'
+                   f'/best[height<={height}][ext=mp4]/best'),
+        'quiet': True,
+        'no_warnings': True,
+        'download_ranges': lambda info, ydl: ranges,
+        'force_keyframes_at_cuts': True,
+        # Pin the container so every clip lands at a known clip_NNN.mp4 path
+        'outtmpl': {'default': os.path.join(temp_dir, "clip_%(section_number)03d.mp4")},
+        'merge_output_format': 'mp4',
+        'final_ext': 'mp4',
+    }
+
+    paths = [None] * len(items)
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Reuse the resolved page/formats from a recent run when possible
+            info = _load_cached_info(video_id)
+            cached = info is not None
+            if not cached:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+                _save_cached_info(video_id, info)
+            try:
+                ydl.process_ie_result(info, download=True)
+            except yt_dlp.utils.DownloadError:
+                # The stream URLs in a cached entry can expire before the TTL,
+                # and the error rarely says so (usually just an ffmpeg exit
+                # code), so retry once with freshly resolved info
+                if not cached:
+                    raise
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+                _save_cached_info(video_id, info)
+                ydl.process_ie_result(info, download=True)
+    except Exception as e:
+        # Sections finished before the error are still usable
+        print(f"   ❌ YouTube Error: {e}")
+
+    for n, (i, _) in enumerate(items):
+        output_filename = os.path.join(temp_dir, f"clip_{i:03d}.mp4")
+        if os.path.exists(output_filename):
+            paths[n] = output_filename
+        else:
+            print(f"   ⚠️ Error: Download failed for segment {i}")
+    return paths
+
+# --- PATH B: LOCAL FILE ---
+async def _extract_local(video_filename, items, target_dir, temp_dir, total, video_encoder, encode_slots):
+    source_file = os.path.join(target_dir, video_filename)
+    if not os.path.exists(source_file):
+        print(f"      ❌ ERROR: Source file not found: {source_file}")
+        print("      (Make sure the video file is in the same folder as this script)")
+        return [None] * len(items)
+
+    # Copied cuts snap to keyframes, which ffprobe reports in absolute time
+    start_time = await asyncio.to_thread(_start_time, source_file) if video_encoder is None else 0.0
+
+    async def extract_one(i, seg):
+        # One ffmpeg run (and so at most one encoder) per segment, so the
+        # semaphore caps the number of encoders running at once, and a failed
+        # run only loses its own clip
+        output_filename = os.path.join(temp_dir, f"clip_{i:03d}.mp4")
+        async with encode_slots:
+            print(f"   [{i+1}/{total}] Extracting (Local): {video_filename} ({format_time(seg.start)} - {format_time(seg.end)})")
+            # Building the command may run ffprobe (keyframe lookup), so do it
+            # off the event loop
+            cmd = await asyncio.to_thread(_build_extract_cmd, source_file, seg, output_filename, video_encoder, start_time)
+            proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            error = await _wait_ffmpeg(proc)
+        if error:
+            print(f"      ❌ FFmpeg Error (segment {i}): {error}")
+            return None
+        return output_filename
+
+    paths = await asyncio.gather(*(extract_one(i, seg) for i, seg in items))
+
+    # Every segment of this source has now been read
+    _drop_from_page_cache(source_file)
+    return paths
+
+def _build_extract_cmd(source_file, seg, output_filename, video_encoder, start_time):
+    # Seeking with -ss/-to before -i is fast and accurate, and only the clip
+    # itself is decoded
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-nostdin", "-y"]
+    if video_encoder is None:
+        # All local sources share the same format, so the clip can be cut
+        # without re-encoding. A copied stream can only begin on a keyframe,
+        # so the cut starts at the last keyframe before the IN point.
+        cmd += [
+            "-ss", str(_keyframe_before(source_file, seg.start, start_time)), "-to", str(seg.end), "-i", source_file,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c", "copy",
+        ]
+    else:
+        cmd += [
+            "-threads", str(FFMPEG_THREADS), # Decoder threads
+            "-ss", str(seg.start), "-to", str(seg.end), "-i", source_file,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            *video_encoder, "-c:a", "aac", # Re-encode to ensure uniform format for concatenation
+            "-threads", str(FFMPEG_THREADS), # Encoder threads
+        ]
+    cmd += ["-avoid_negative_ts", "make_zero", output_filename]
+    return cmd
+
+def _load_cached_info(video_id):
+    cache_file = os.path.join(INFO_CACHE_DIR, f"{video_id}.json")
+    try:
+        if time.time() - os.path.getmtime(cache_file) > INFO_CACHE_TTL:
+            return None
+        return load_json(cache_file)
+    except (OSError, ValueError):
+        return None
+
+def _save_cached_info(video_id, info):
+    try:
+        os.makedirs(INFO_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(INFO_CACHE_DIR, f"{video_id}.json"), 'w') as f:
+            json.dump(info, f)
+    except OSError:
+        pass
+
+@functools.lru_cache(maxsize=None)
+def detect_video_encoder():
+    # Listing an encoder only means ffmpeg was built with it, so check that
+    # it can actually encode a frame (with its options) on this machine
+    for name, options in H264_ENCODERS[:-1]:
+        cmd = [
+            "ffmpeg", "-hide_banner", "-nostdin", "-f", "lavfi", "-i", "color=black:s=256x256",
+            "-frames:v", "1", "-c:v", name, *options, "-f", "null", "-"
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, OSError):
+            continue
+        print(f"   🚀 Using hardware encoder: {name}")
+        return ("-c:v", name, *options)
+    name, options = H264_ENCODERS[-1]
+    return ("-c:v", name, *options)
+
+def _stream_count(video_file):
+    try:
+        probe = json.loads(subprocess.check_output(
+            ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", video_file]))
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+    return len(probe.get('streams', []))
+
+def _probe_signature(source_file, cache):
+    # The stream parameters that have to match for clips to concat with -c copy
+    try:
+        stat = os.stat(source_file)
+    except OSError:
+        return None
+    key = os.path.abspath(source_file)
+    entry = cache.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return tuple(entry['signature'])
+
+    try:
+        probe = json.loads(subprocess.check_output(
+            ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", source_file]))
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+    video = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'audio'), {})
+    signature = (video.get('codec_name'), video.get('width'), video.get('height'), video.get('r_frame_rate'),
+                 audio.get('codec_name'), audio.get('sample_rate'))
+    cache[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'signature': signature}
+    return signature
+
+def _load_probe_cache():
+    try:
+        return load_json(PROBE_CACHE_FILE)
+    except (OSError, ValueError):
+        return {}
+
+def _save_probe_cache(cache):
+    try:
+        os.makedirs(INFO_CACHE_DIR, exist_ok=True)
+        with open(PROBE_CACHE_FILE, 'w') as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+def _start_time(source_file):
+    # Timestamp of the first packet; ffprobe reports absolute timestamps while
+    # ffmpeg's -ss is relative to this
+    cmd = ["ffprobe", "-v", "quiet", "-show_entries", "format=start_time", "-of", "csv=p=0", source_file]
+    try:
+        return float(subprocess.check_output(cmd, text=True).strip())
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return 0.0
+
+def _keyframe_before(source_file, t, start_time=0.0):
+    # Only look at the keyframes in a short window before t (t and the result
+    # are relative to the start of the file, like -ss)
+    t_abs = t + start_time
+    cmd = [
+        "ffprobe", "-v", "quiet", "-select_streams", "v:0", "-skip_frame", "nokey",
+        "-show_entries", "frame=pts_time", "-of", "csv=p=0",
+        "-read_intervals", f"{max(0, t_abs - KEYFRAME_SEARCH_WINDOW)}%{t_abs}",
+        source_file
+    ]
+    try:
+        output = subprocess.check_output(cmd, text=True)
+    except (subprocess.CalledProcessError, OSError):
+        return t
+    keyframes = []
+    for line in output.splitlines():
+        try:
+            keyframes.append(float(line.strip().rstrip(',')))
+        except ValueError:
+            pass
+    return max((k for k in keyframes if k <= t_abs), default=t_abs) - start_time
+
+def _fast_rmtree(path):
+    # temp_clips only holds flat files, so unlink them straight from the
+    # scandir entries instead of letting rmtree stat each one
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+        os.rmdir(path)
+    except OSError:
+        pass
+
+def _drop_from_page_cache(path):
+    # Tell the kernel a file's cached pages will not be needed again, so a
+    # multi-GB source does not push everything else out of memory
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def load_json(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
 def format_time(seconds):
     m = int(seconds // 60)
     s = int(seconds % 60)